@@ -4,22 +4,64 @@ Enterprise-grade architecture analysis system.
 """
 import asyncio
 import time
-import json
-import random
+import orjson
+from contextlib import suppress
 from datetime import datetime
-from pathlib import Path
 import logging
 
-from core import BrowserManager, SitemapCrawler, TemplateDetector, FunctionalAnalyzer
+from core import BrowserManager, SitemapCrawler, TemplateDetector, FunctionalAnalyzer, new_http_client
 from models import SiteArchitecture
 from config import settings
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+_logging_configured = False
+
+
+def configure_logging() -> None:
+    """Install the default log handler once, unless the host app already has one."""
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('{asctime} - {name} - {levelname} - {message}', style='{'))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+
+# Global nav + tech stack extractor (built once, reused for every analysis)
+_META_JS = """
+() => {
+    const nav = [];
+    const links = document.getElementsByTagName('a');
+    for (let i = 0; i < links.length && nav.length < 15; i++) {
+        const a = links[i];
+        for (let p = a.parentNode; p; p = p.parentNode) {
+            const tag = p.tagName;
+            if (tag === 'NAV' || tag === 'HEADER') {
+                const text = a.textContent.trim();
+                if (text) nav.push({text, target: a.href, type: 'main_nav'});
+                break;
+            }
+        }
+    }
+    const stack = {};
+    if (window.React) stack.frontend = 'React';
+    else if (window.Vue) stack.frontend = 'Vue';
+    else if (window.Angular) stack.frontend = 'Angular';
+    if (window.ga || window.gtag) stack.analytics = 'Google Analytics';
+    const gen = document.querySelector('meta[name="generator"]');
+    if (gen) stack.cms = gen.content;
+    return {nav, stack};
+}
+"""
+
 
 class ReverseEngineeringAgent:
     """
@@ -28,251 +70,222 @@ class ReverseEngineeringAgent:
     """
     
     def __init__(self, headless: bool = True):
-        self.browser = BrowserManager(headless=headless)
-        self.crawler = SitemapCrawler(max_urls=settings.max_urls_to_discover)
+        configure_logging()
+        # One connection pool for sitemap fetches and LLM calls
+        self._http = new_http_client()
+        self.browser = BrowserManager(
+            headless=headless,
+            timeout=settings.browser_timeout,
+            pool_size=settings.analysis_concurrency,
+            block_heavy_resources=settings.block_heavy_resources,
+            max_navigations=settings.browser_context_max_navigations
+        )
+        self.crawler = SitemapCrawler(
+            max_urls=settings.max_urls_to_discover,
+            max_depth=settings.max_crawl_depth,
+            concurrency=settings.analysis_concurrency,
+            http_client=self._http
+        )
         self.detector = TemplateDetector()
-        self.analyzer = FunctionalAnalyzer()
+        self.analyzer = FunctionalAnalyzer(http_client=self._http)
+        self.last_report_json: bytes = b""
         
     async def analyze_site(self, target_url: str, progress_callback=None) -> SiteArchitecture:
         """
         Complete site analysis.
         
+        The browser context stays open between calls; call close() when done.
+        
         Returns: SiteArchitecture with functional blueprint
         """
         start_time = time.time()
+        report_id = time.strftime("%Y%m%d_%H%M%S", time.localtime(start_time))
+        
+        logger.info("=== Starting analysis: %s ===", target_url)
+        
+        # Phase 1: Initialize
+        if progress_callback:
+            progress_callback(0.05, "Initializing browser...")
+        
+        await self.browser.initialize()
+        
+        # Phase 2: Discover URLs
+        if progress_callback:
+            progress_callback(0.15, "Discovering site structure...")
+        
+        urls = await self.crawler.discover_urls(self.browser, target_url)
+        logger.info("Discovered %s URLs", len(urls))
+        
+        # Phase 3: Detect templates
+        if progress_callback:
+            progress_callback(0.25, "Identifying page templates...")
+        
+        templates = self.detector.detect_templates(urls)
+        logger.info("Identified %s templates", len(templates))
         
+        # Phase 4: Analyze templates with concurrency control
+        if progress_callback:
+            progress_callback(0.35, "Analyzing functional specifications...")
+        
+        # Limit analysis, skipping templates without a URL to visit
+        work = []
+        for template in templates[:settings.max_templates_to_analyze]:
+            rep_url = self.detector.get_representative_url(template)
+            if rep_url:
+                work.append((template, rep_url))
+        
+        # Concurrency control
+        semaphore = asyncio.Semaphore(settings.analysis_concurrency)
+        total_to_analyze = len(work)
+        
+        # Global elements are extracted on a separate page while templates are analyzed
+        global_page = await self.browser.new_page(block_resources=True)
+        global_task = asyncio.create_task(self._extract_globals(global_page, target_url))
+        
+        # Execute analyses concurrently, reporting progress as each one finishes
+        tasks = [
+            asyncio.create_task(self._analyze_one(template, rep_url, semaphore))
+            for template, rep_url in work
+        ]
         try:
-            logger.info(f"=== Starting analysis: {target_url} ===")
-            
-            # Phase 1: Initialize
-            if progress_callback:
-                progress_callback(0.05, "Initializing browser...")
-            
-            await self.browser.initialize()
-            page = self.browser.page
-            
-            # Phase 2: Discover URLs
-            if progress_callback:
-                progress_callback(0.15, "Discovering site structure...")
-            
-            urls = await self.crawler.discover_urls(page, target_url)
-            logger.info(f"Discovered {len(urls)} URLs")
-            
-            # Phase 3: Detect templates
-            if progress_callback:
-                progress_callback(0.25, "Identifying page templates...")
-            
-            templates = self.detector.detect_templates(urls)
-            logger.info(f"Identified {len(templates)} templates")
-            
-            # Phase 4: Analyze templates with concurrency control
-            if progress_callback:
-                progress_callback(0.35, "Analyzing functional specifications...")
-            
-            # Limit analysis
-            templates_to_analyze = templates[:settings.max_templates_to_analyze]
-            template_specs = []
-            
-            # Concurrency control
-            semaphore = asyncio.Semaphore(3)  # Max 3 concurrent analyses
-            completed = 0
-            total_to_analyze = len(templates_to_analyze)
-            
-            async def analyze_with_semaphore(idx: int, template):
-                """Analyze template with concurrency control."""
-                nonlocal completed
-                
-                async with semaphore:
-                    rep_url = self.detector.get_representative_url(template)
-                    if not rep_url:
-                        return None
-                    
-                    progress = 0.35 + (0.55 * (completed / total_to_analyze))
-                    if progress_callback:
-                        progress_callback(
-                            progress,
-                            f"Analyzing {completed+1}/{total_to_analyze}: {template.template_type}"
-                        )
-                    
-                    try:
-                        # Navigate to page
-                        await self.browser.navigate(rep_url)
-                        await asyncio.sleep(2)
-                        
-                        # Check if it's a 404 page BEFORE analyzing
-                        title = await page.title()
-                        content = await page.content()
-                        
-                        if self._is_404_page(title, content, rep_url):
-                            logger.warning(f"Skipping 404 page: {rep_url}")
-                            completed += 1
-                            
-                            return {
-                                'template_name': '404 Error Page',
-                                'template_pattern': template.pattern,
-                                'layout_engine': 'N/A',
-                                'design_system': {
-                                    'primary_color': '#000000',
-                                    'background_color': '#ffffff',
-                                    'text_color': '#000000',
-                                    'font_family': 'N/A',
-                                    'button_style': 'N/A'
-                                },
-                                'components': [],
-                                'analyzed_url': rep_url,
-                                'status': 'skipped',
-                                'error_message': 'Page is a 404 error'
-                            }
-                        
-                        # Analyze with LLM
-                        spec_data = await self.analyzer.analyze(
-                            page,
-                            template.pattern,
-                            settings.screenshots_dir
-                        )
-                        
-                        completed += 1
-                        logger.info(f"✓ Completed {template.pattern}")
-                        
-                        # Rate limiting
-                        await asyncio.sleep(random.uniform(2, 5))
-                        
-                        return spec_data
-                        
-                    except Exception as e:
-                        logger.error(f"✗ Failed {template.pattern}: {e}")
-                        completed += 1
-                        
-                        # Return failed spec
-                        return {
-                            'template_name': template.template_type,
-                            'template_pattern': template.pattern,
-                            'layout_engine': 'unknown',
-                            'design_system': {
-                                'primary_color': '#000000',
-                                'background_color': '#ffffff',
-                                'text_color': '#000000',
-                                'font_family': 'unknown',
-                                'button_style': 'unknown'
-                            },
-                            'components': [],
-                            'analyzed_url': rep_url,
-                            'status': 'failed',
-                            'error_message': str(e)
-                        }
-            
-            # Execute analyses concurrently
-            tasks = [analyze_with_semaphore(idx, t) for idx, t in enumerate(templates_to_analyze)]
-            results = await asyncio.gather(*tasks)
+            for completed, finished in enumerate(asyncio.as_completed(tasks), start=1):
+                spec_data = await finished
+                if progress_callback:
+                    progress_callback(
+                        0.35 + (0.55 * (completed / total_to_analyze)),
+                        f"Analyzed {completed}/{total_to_analyze}: {spec_data['template_pattern']}"
+                    )
             
-            # Filter out None results
-            template_specs = [r for r in results if r is not None]
+            # Keep specs in template order
+            template_specs = [task.result() for task in tasks]
             
             # Phase 5: Global analysis
             if progress_callback:
                 progress_callback(0.90, "Extracting global elements...")
             
-            await self.browser.navigate(target_url)
-            global_nav = await self._extract_global_nav(page)
-            tech_stack = await self._detect_tech_stack(page)
-            
-            # Build architecture
-            duration = time.time() - start_time
-            
-            architecture = SiteArchitecture(
-                target_url=target_url,
-                crawl_timestamp=datetime.now(),
-                total_urls_discovered=len(urls),
-                unique_templates_identified=len(templates),
-                templates=templates,
-                template_specs=template_specs,
-                global_navigation=global_nav,
-                tech_stack=tech_stack,
-                analysis_duration_seconds=round(duration, 2)
-            )
-            
-            # Save report
-            self._save_report(architecture)
-            
-            logger.info(f"=== Analysis complete: {duration:.1f}s ===")
-            
-            if progress_callback:
-                progress_callback(1.0, "Complete!")
-            
-            return architecture
-            
+            global_nav, tech_stack = await global_task
         finally:
-            await self.browser.close()
-    
-    def _is_404_page(self, title: str, content: str, url: str) -> bool:
-        """Detect if page is a 404 error page."""
-        title_lower = title.lower()
-        content_lower = content.lower()
+            # On failure, stop the remaining work so no task keeps a pooled page busy,
+            # and collect every outcome so no exception goes unretrieved
+            for task in (*tasks, global_task):
+                task.cancel()
+            await asyncio.gather(*tasks, global_task, return_exceptions=True)
+            with suppress(Exception):
+                await global_page.close()
         
-        # Common 404 indicators
-        error_keywords = [
-            '404',
-            'not found',
-            'page not found',
-            "page can't be found",
-            "page could not be found",
-            'page does not exist',
-            "couldn't find",
-            "can't find that page"
-        ]
+        # Build architecture
+        duration = time.time() - start_time
         
-        # Check title
-        if any(keyword in title_lower for keyword in error_keywords):
-            return True
+        architecture = SiteArchitecture(
+            target_url=target_url,
+            crawl_timestamp=datetime.now(),
+            total_urls_discovered=len(urls),
+            unique_templates_identified=len(templates),
+            templates=templates,
+            template_specs=template_specs,
+            global_navigation=global_nav,
+            tech_stack=tech_stack,
+            analysis_duration_seconds=round(duration, 2),
+            report_id=report_id
+        )
         
-        # Check content (first 2000 chars for performance)
-        content_sample = content_lower[:2000]
+        # Save report off the event loop (bytes kept for the UI export)
+        _, self.last_report_json = await asyncio.to_thread(self._save_report, architecture)
         
-        # Look for common 404 patterns in HTML
-        if '404' in content_sample and ('not found' in content_sample or 'error' in content_sample):
-            return True
+        logger.info("=== Analysis complete: %.1fs ===", duration)
         
-        return False
+        if progress_callback:
+            progress_callback(1.0, "Complete!")
+        
+        return architecture
     
-    async def _extract_global_nav(self, page) -> list:
-        """Extract global navigation."""
+    async def _analyze_one(self, template, rep_url: str, semaphore: asyncio.Semaphore) -> dict:
+        """
+        Analyze a single template.
+        
+        Page work runs under the concurrency limit; the LLM call runs after the
+        page is back in the pool so the next template can start loading.
+        """
+        # Reuse the spec from a previous run of the same template
+        cached = await asyncio.to_thread(self.analyzer.cached_spec, rep_url, template.pattern)
+        if cached:
+            logger.info("✓ Cached %s", template.pattern)
+            return cached
+        
         try:
-            nav = await page.evaluate("""
-                () => Array.from(document.querySelectorAll('nav a, header a'))
-                    .map(a => ({text: a.textContent.trim(), target: a.href, type: 'main_nav'}))
-                    .filter(i => i.text.length > 0)
-                    .slice(0, 15)
-            """)
-            return nav
-        except:
-            return []
+            async with semaphore, self.browser.acquire_page() as page:
+                # Navigate to page (404s are detected from the response and DOM in capture)
+                response = await self.browser.navigate(rep_url, page=page)
+                
+                capture = await self.analyzer.capture(
+                    page,
+                    template.pattern,
+                    settings.screenshots_dir,
+                    template.template_type,
+                    response.status if response else 0
+                )
+            
+            # Analyze with LLM
+            spec_data = await self.analyzer.complete(capture)
+            try:
+                await asyncio.to_thread(self.analyzer.store_spec, rep_url, template.pattern, spec_data)
+            except Exception as e:
+                # The analysis itself succeeded; losing the cache entry only costs a re-run
+                logger.warning("Could not cache spec for %s: %s", template.pattern, e)
+            logger.info("✓ Completed %s", template.pattern)
+            
+            return spec_data
+            
+        except Exception as e:
+            logger.error("✗ Failed %s: %s", template.pattern, e)
+            
+            # Return failed spec
+            return {
+                'template_name': template.template_type,
+                'template_pattern': template.pattern,
+                'layout_engine': 'unknown',
+                'design_system': {
+                    'primary_color': '#000000',
+                    'background_color': '#ffffff',
+                    'text_color': '#000000',
+                    'font_family': 'unknown',
+                    'button_style': 'unknown'
+                },
+                'components': [],
+                'analyzed_url': rep_url,
+                'status': 'failed',
+                'error_message': str(e)
+            }
+    
+    async def close(self) -> None:
+        """Release the browser context and HTTP connections kept alive between analyses."""
+        await self.browser.close()
+        await self.analyzer.aclose()
+        await self._http.aclose()
+    
+    async def _extract_globals(self, page, target_url: str) -> tuple:
+        """Navigate a dedicated page to the target and extract global elements."""
+        try:
+            await self.browser.navigate(target_url, page=page)
+            return await self._extract_page_meta(page)
+        finally:
+            await page.close()
     
-    async def _detect_tech_stack(self, page) -> dict:
-        """Detect technology stack."""
+    async def _extract_page_meta(self, page) -> tuple:
+        """Extract global navigation and tech stack in a single evaluate."""
         try:
-            return await page.evaluate("""
-                () => {
-                    const stack = {};
-                    if (window.React) stack.frontend = 'React';
-                    else if (window.Vue) stack.frontend = 'Vue';
-                    else if (window.Angular) stack.frontend = 'Angular';
-                    if (window.ga || window.gtag) stack.analytics = 'Google Analytics';
-                    const gen = document.querySelector('meta[name="generator"]');
-                    if (gen) stack.cms = gen.content;
-                    return stack;
-                }
-            """)
+            meta = await page.evaluate(_META_JS)
+            return meta.get('nav', []), meta.get('stack', {})
         except:
-            return {}
+            return [], {}
     
-    def _save_report(self, architecture: SiteArchitecture) -> Path:
-        """Save JSON report."""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"architecture_{timestamp}.json"
+    def _save_report(self, architecture: SiteArchitecture) -> tuple:
+        """Save JSON report. Returns the file path and the serialized bytes."""
+        filename = f"architecture_{architecture.report_id}.json"
         filepath = settings.reports_dir / filename
         
-        with open(filepath, 'w') as f:
-            f.write(architecture.model_dump_json(indent=2))
+        payload = orjson.dumps(architecture.model_dump(mode='json'), option=orjson.OPT_INDENT_2)
+        filepath.write_bytes(payload)
         
-        logger.info(f"Report saved: {filepath}")
-        return filepath
\ No newline at end of file
+        logger.info("Report saved: %s", filepath)
+        return filepath, payload
\ No newline at end of file
@@ -3,12 +3,20 @@ Enterprise Streamlit interface.
 Professional, minimal, functional.
 """
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import asyncio
-import json
-from datetime import datetime
+import threading
+import weakref
+import orjson
 from pathlib import Path
 
+try:
+    import uvloop
+except ImportError:  # Optional (not available on Windows); falls back to the asyncio loop
+    uvloop = None
+
 from agent import ReverseEngineeringAgent
+from core import shutdown_pool
 from config import settings
 
 # Config
@@ -62,6 +70,9 @@ def main():
     # Main
     if analyze_btn and target_url:
         run_analysis(target_url, headless)
+    elif 'last_analysis' in st.session_state:
+        # Reruns redisplay the previous result with its cached JSON export
+        display_results(*st.session_state.last_analysis)
     else:
         show_info()
 
@@ -91,35 +102,107 @@ def show_info():
         """)
 
 
+class SessionLoop:
+    """
+    Event loop on a background thread, owned by one Streamlit session.
+    
+    Kept in session_state; when Streamlit drops the session (or at process
+    exit) the registered agents and the loop's browsers are closed and its
+    thread stops.
+    """
+    
+    def __init__(self):
+        self.loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+        self.thread = threading.Thread(target=run_loop, args=(self.loop,), daemon=True)
+        self.thread.start()
+        # Agents running on this loop, closed with it
+        self.agents: list = []
+        # The callback must not reference self, or the session could never be collected
+        weakref.finalize(self, shutdown_session_loop, self.loop, self.agents)
+
+
+def run_loop(loop: asyncio.AbstractEventLoop):
+    """Thread body: serve the loop until shutdown_session_loop stops it."""
+    loop.run_forever()
+    loop.close()
+
+
+async def close_session(agents: list):
+    """Close the session's agents (contexts, HTTP clients), then its shared browsers."""
+    for agent in agents:
+        try:
+            await agent.close()
+        except Exception:
+            pass
+    await shutdown_pool()
+
+
+def shutdown_session_loop(loop: asyncio.AbstractEventLoop, agents: list):
+    """Close everything owned by a session loop, then stop it (doesn't block the caller)."""
+    if loop.is_closed():
+        return
+    future = asyncio.run_coroutine_threadsafe(close_session(agents), loop)
+    future.add_done_callback(lambda _: loop.call_soon_threadsafe(loop.stop))
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Session-wide event loop running on a background thread."""
+    if 'session_loop' not in st.session_state:
+        st.session_state.session_loop = SessionLoop()
+    session_loop = st.session_state.session_loop
+    
+    # Let progress callbacks on the loop thread write to the current script run
+    add_script_run_ctx(session_loop.thread, get_script_run_ctx())
+    return session_loop.loop
+
+
+def get_agent(loop: asyncio.AbstractEventLoop, headless: bool) -> ReverseEngineeringAgent:
+    """Session-wide agent whose browser stays warm between analyses."""
+    agent = st.session_state.get('agent')
+    session_agents = st.session_state.session_loop.agents
+    
+    if agent is not None and agent.browser.headless != headless:
+        # Also close the old mode's browser; nothing in this session uses it anymore
+        asyncio.run_coroutine_threadsafe(agent.close(), loop).result()
+        asyncio.run_coroutine_threadsafe(shutdown_pool(agent.browser.headless), loop).result()
+        if agent in session_agents:
+            session_agents.remove(agent)
+        agent = None
+    
+    if agent is None:
+        agent = ReverseEngineeringAgent(headless=headless)
+        st.session_state.agent = agent
+        session_agents.append(agent)
+    
+    return agent
+
+
 def run_analysis(url: str, headless: bool):
     """Execute analysis."""
     progress = st.progress(0)
-    status = st.empty()
     
     def update(p: float, msg: str):
-        progress.progress(p)
-        status.text(msg)
+        # Bar and label in one element, so each tick is a single delta
+        progress.progress(p, text=msg)
     
-    agent = ReverseEngineeringAgent(headless=headless)
+    loop = get_event_loop()
+    agent = get_agent(loop, headless)
     
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        arch = loop.run_until_complete(
-            agent.analyze_site(url, progress_callback=update)
-        )
+        arch = asyncio.run_coroutine_threadsafe(
+            agent.analyze_site(url, progress_callback=update),
+            loop
+        ).result()
         
-        display_results(arch)
+        st.session_state.last_analysis = (arch, agent.last_report_json)
+        display_results(arch, agent.last_report_json)
         
     except Exception as e:
         st.error(f"Analysis failed: {e}")
         st.exception(e)
-    finally:
-        loop.close()
 
 
-def display_results(arch):
+def display_results(arch, report_json: bytes):
     """Display results."""
     st.success("Analysis Complete")
     
@@ -134,92 +217,99 @@ def display_results(arch):
     
     # Template tree
     st.subheader("Template Structure")
-    tree = {t.pattern: {"type": t.template_type, "matches": t.total_matches} for t in arch.templates}
-    st.json(tree)
+    tree = orjson.dumps(
+        {t.pattern: {"type": t.template_type, "matches": t.total_matches} for t in arch.templates},
+        option=orjson.OPT_INDENT_2
+    )
+    st.code(tree.decode(), language="json")
     
     st.divider()
     
-    # Specs - Handle both dict and object formats
+    # Specs (template_specs entries are plain dicts)
     st.subheader("Functional Specifications")
     
-    # Count successful vs failed vs skipped
-    success_count = sum(1 for s in arch.template_specs if isinstance(s, dict) and s.get('status') == 'success')
-    failed_count = sum(1 for s in arch.template_specs if isinstance(s, dict) and s.get('status') == 'failed')
-    skipped_count = sum(1 for s in arch.template_specs if isinstance(s, dict) and s.get('status') == 'skipped')
-    
-    if skipped_count > 0:
-        st.info(f"Info: {skipped_count} page(s) skipped (404 errors)")
-    
-    if failed_count > 0:
-        st.warning(f"Warning: {failed_count} template(s) failed to analyze. Check logs for details.")
+    # Status banners are filled in after the render loop has counted statuses
+    info_slot = st.empty()
+    warn_slot = st.empty()
+    success_count = 0
+    failed_count = 0
+    skipped_count = 0
     
     # Only show successful analyses
     for spec in arch.template_specs:
-        # Handle both dict and Pydantic model
-        if isinstance(spec, dict):
-            template_pattern = spec.get('template_pattern', 'unknown')
-            template_name = spec.get('template_name', 'Unknown')
-            status = spec.get('status', 'success')
+        spec_get = spec.get
+        template_pattern = spec_get('template_pattern', 'unknown')
+        template_name = spec_get('template_name', 'Unknown')
+        status = spec_get('status', 'success')
+        
+        # Skip 404 pages in display
+        if status == 'skipped':
+            skipped_count += 1
+            continue
+        
+        if status == 'failed':
+            failed_count += 1
+        elif status == 'success':
+            success_count += 1
+        
+        # Show status indicator
+        status_indicator = "[SUCCESS]" if status == "success" else "[FAILED]"
+        
+        with st.expander(f"{status_indicator} {template_pattern} ({template_name})"):
             
-            # Skip 404 pages in display
-            if status == 'skipped':
+            if status == "failed":
+                st.error(f"Analysis failed: {spec_get('error_message', 'Unknown error')}")
+                st.write(f"URL: {spec_get('analyzed_url', 'N/A')}")
                 continue
             
-            # Show status indicator
-            status_indicator = "[SUCCESS]" if status == "success" else "[FAILED]"
+            # Layout (each block is one markdown element; lines break with "  \n")
+            layout_engine = spec_get('layout_engine', 'unknown')
+            st.markdown(f"**Layout:**  \nEngine: {layout_engine}")
             
-            with st.expander(f"{status_indicator} {template_pattern} ({template_name})"):
-                
-                if status == "failed":
-                    st.error(f"Analysis failed: {spec.get('error_message', 'Unknown error')}")
-                    st.write(f"URL: {spec.get('analyzed_url', 'N/A')}")
-                    continue
-                
-                # Layout
-                layout_engine = spec.get('layout_engine', 'unknown')
-                st.markdown("**Layout:**")
-                st.write(f"Engine: {layout_engine}")
-                
-                # Design System
-                design = spec.get('design_system', {})
-                if design:
-                    st.markdown("**Design System:**")
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.write(f"Primary Color: {design.get('primary_color', 'N/A')}")
-                        st.write(f"Background: {design.get('background_color', 'N/A')}")
-                    with col2:
-                        st.write(f"Text Color: {design.get('text_color', 'N/A')}")
-                        st.write(f"Font: {design.get('font_family', 'N/A')}")
-                
-                # Components
-                components = spec.get('components', [])
-                if components:
-                    st.markdown(f"**Components ({len(components)}):**")
-                    for idx, comp in enumerate(components[:5]):  # Show first 5
-                        with st.container():
-                            st.markdown(f"**{idx+1}. {comp.get('name', 'Unnamed')}**")
-                            st.write(f"Location: {comp.get('location', 'N/A')}")
-                            st.write(f"Function: {comp.get('functionality', 'N/A')}")
-                            
-                            if comp.get('trigger_events'):
-                                st.write(f"Events: {', '.join(comp['trigger_events'][:3])}")
-                    
-                    if len(components) > 5:
-                        st.info(f"+ {len(components) - 5} more components (see JSON export)")
+            # Design System
+            design = spec_get('design_system', {})
+            if design:
+                st.markdown("**Design System:**")
+                col1, col2 = st.columns(2)
+                col1.markdown(
+                    f"Primary Color: {design.get('primary_color', 'N/A')}  \n"
+                    f"Background: {design.get('background_color', 'N/A')}"
+                )
+                col2.markdown(
+                    f"Text Color: {design.get('text_color', 'N/A')}  \n"
+                    f"Font: {design.get('font_family', 'N/A')}"
+                )
+            
+            # Components
+            components = spec_get('components', [])
+            if components:
+                st.markdown(f"**Components ({len(components)}):**")
+                for idx, comp in enumerate(components[:5]):  # Show first 5
+                    lines = [
+                        f"**{idx+1}. {comp.get('name', 'Unnamed')}**",
+                        f"Location: {comp.get('location', 'N/A')}",
+                        f"Function: {comp.get('functionality', 'N/A')}"
+                    ]
+                    if comp.get('trigger_events'):
+                        lines.append(f"Events: {', '.join(comp['trigger_events'][:3])}")
+                    st.markdown("  \n".join(lines))
                 
-                # Screenshot
-                screenshot_path = spec.get('screenshot_path')
-                if screenshot_path:
-                    img_path = Path(screenshot_path)
-                    if img_path.exists():
-                        st.markdown("**Screenshot:**")
-                        st.image(str(img_path), width=600)
-        
-        else:
-            # Fallback for Pydantic models (shouldn't happen but just in case)
-            with st.expander(f"Template: {spec.template_pattern} ({spec.template_name})"):
-                st.json(spec.model_dump())
+                if len(components) > 5:
+                    st.info(f"+ {len(components) - 5} more components (see JSON export)")
+            
+            # Screenshot
+            screenshot_path = spec_get('screenshot_path')
+            if screenshot_path:
+                img_path = Path(screenshot_path)
+                if img_path.exists():
+                    st.markdown("**Screenshot:**")
+                    st.image(str(img_path), width=600)
+    
+    if skipped_count > 0:
+        info_slot.info(f"Info: {skipped_count} page(s) skipped (404 errors)")
+    
+    if failed_count > 0:
+        warn_slot.warning(f"Warning: {failed_count} template(s) failed to analyze. Check logs for details.")
     
     st.divider()
     
@@ -232,12 +322,11 @@ def display_results(arch):
     
     # Export
     st.subheader("Export")
-    json_data = arch.model_dump_json(indent=2)
     
     st.download_button(
         "Download Blueprint (JSON)",
-        json_data,
-        file_name=f"architecture_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+        report_json,
+        file_name=f"architecture_{arch.report_id}.json",
         mime="application/json"
     )
     
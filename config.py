@@ -1,6 +1,7 @@
 """
 Enterprise configuration management.
 """
+from functools import lru_cache
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pathlib import Path
 
@@ -13,13 +14,16 @@ class Settings(BaseSettings):
     llm_model: str = "gpt-4o-mini"
     llm_temperature: float = 0.0
     llm_max_tokens: int = 8000
+    openai_max_concurrency: int = 8  # In-flight LLM requests, keeps bursts under the TPM limit
     
     # Browser settings
     browser_headless: bool = True
     browser_viewport_width: int = 1920
     browser_viewport_height: int = 1080
-    browser_timeout: int = 45000  # Increased to 45 seconds
+    browser_timeout: int = 30000  # Navigation waits for DOMContentLoaded, not networkidle
     use_stealth_mode: bool = True
+    block_heavy_resources: bool = True  # Abort tracker requests (and heavy resources on unscreenshotted pages)
+    browser_context_max_navigations: int = 200  # Recycle the context between analyses after this many
     
     # Crawler settings
     max_urls_to_discover: int = 500
@@ -28,23 +32,34 @@ class Settings(BaseSettings):
     
     # Analysis settings
     max_templates_to_analyze: int = 20
+    analysis_concurrency: int = 4
     screenshot_quality: int = 85
+    llm_image_max_edge: int = 1024  # Long edge of the image sent to the LLM (0 = full size)
+    llm_dom_token_budget: int = 1500  # Prompt tokens allowed for the DOM summary
+    llm_image_detail: str = "low"  # OpenAI vision detail: "low" is a flat ~85 tokens, "high"/"auto" tile the image
+    use_spec_cache: bool = True  # Reuse stored specs for unchanged (url, template, prompt)
+    spec_cache_max_age_hours: float = 24.0  # Per-URL specs older than this are re-analyzed (0 = no limit)
     
     # Storage
     reports_dir: Path = Path("reports")
     screenshots_dir: Path = Path("screenshots")
+    cache_dir: Path = Path("reports/cache")
     
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
         extra="ignore"
     )
-    
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        # Create directories
-        self.reports_dir.mkdir(exist_ok=True)
-        self.screenshots_dir.mkdir(exist_ok=True)
 
 
-settings = Settings()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Load settings once and create the output directories."""
+    s = Settings()
+    s.reports_dir.mkdir(exist_ok=True)
+    s.screenshots_dir.mkdir(exist_ok=True)
+    s.cache_dir.mkdir(parents=True, exist_ok=True)
+    return s
+
+
+settings = get_settings()
\ No newline at end of file
@@ -1,11 +1,16 @@
 """Core modules."""
 from .browser_manager import BrowserManager
+from .browser_pool import get_browser, shutdown_pool
+from .http_client import new_http_client
 from .sitemap_crawler import SitemapCrawler
 from .template_detector import TemplateDetector
 from .functional_analyzer import FunctionalAnalyzer
 
 __all__ = [
     'BrowserManager',
+    'get_browser',
+    'shutdown_pool',
+    'new_http_client',
     'SitemapCrawler',
     'TemplateDetector',
     'FunctionalAnalyzer'
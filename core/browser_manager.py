@@ -2,12 +2,57 @@
 Production browser management with enterprise features.
 """
 import asyncio
-from typing import Optional
-from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+import re
+from contextlib import asynccontextmanager, suppress
+from typing import AsyncIterator, Optional
+from playwright.async_api import Browser, BrowserContext, Page, Response
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 import logging
 
+from .browser_pool import get_browser
+
 logger = logging.getLogger(__name__)
 
+_STEALTH_JS = "Object.defineProperty(navigator,'webdriver',{get:()=>undefined});"
+
+# Cookie banners and popups, matched by a single union locator (visible ones only,
+# so a hidden "Close"/"OK" earlier in the DOM can't shadow the real banner button)
+_POPUP_SELECTOR = ', '.join((
+    'button:has-text("Accept")',
+    'button:has-text("Accept all")',
+    'button:has-text("Accept All")',
+    'button:has-text("I agree")',
+    'button:has-text("I Agree")',
+    '[aria-label*="Accept"]',
+    '[aria-label*="accept"]',
+    'button:has-text("OK")',
+    'button:has-text("Close")',
+    '.cookie-accept',
+    '#cookie-accept',
+    '.accept-cookies',
+)) + ' >> visible=true'
+
+# Resources never needed on pages that are not screenshotted
+_BLOCKED_RESOURCE_TYPES = frozenset({'image', 'media', 'font', 'stylesheet'})
+
+# Analytics/ad hosts blocked on every page when block_heavy_resources is on. Only
+# URLs on these hosts (or their subdomains) are routed, so every other request
+# goes straight to the network instead of through a Python handler.
+_BLOCKED_HOSTS = (
+    'doubleclick.net',
+    'googlesyndication.com',
+    'googletagmanager.com',
+    'google-analytics.com',
+    'hotjar.com',
+    'facebook.net',
+    'segment.io',
+    'mixpanel.com',
+)
+_BLOCKED_HOSTS_RE = re.compile(
+    r'^[a-z][a-z0-9+.-]*://([^/?#]*\.)?(' + '|'.join(map(re.escape, _BLOCKED_HOSTS)) + r')(:\d+)?([/?#]|$)',
+    re.IGNORECASE
+)
+
 
 class BrowserManager:
     """Enterprise-grade browser automation."""
@@ -17,120 +62,185 @@ class BrowserManager:
         headless: bool = True,
         viewport_width: int = 1920,
         viewport_height: int = 1080,
-        timeout: int = 30000
+        timeout: int = 30000,
+        pool_size: int = 3,
+        block_heavy_resources: bool = True,
+        max_navigations: int = 200
     ):
         self.headless = headless
         self.viewport_width = viewport_width
         self.viewport_height = viewport_height
         self.timeout = timeout
+        self.pool_size = pool_size
+        self.block_heavy_resources = block_heavy_resources
+        self.max_navigations = max_navigations
         
-        self.playwright = None
         self.browser: Optional[Browser] = None
         self.context: Optional[BrowserContext] = None
         self.page: Optional[Page] = None
+        self._pool_pages: list = []
+        self._page_pool: Optional[asyncio.Queue] = None
+        self._navigations = 0
         
     async def initialize(self) -> None:
-        """Initialize browser with anti-detection."""
-        self.playwright = await async_playwright().start()
+        """
+        Open a fresh context on the shared browser. No-op if already open.
         
-        self.browser = await self.playwright.chromium.launch(
-            headless=self.headless,
-            args=[
-                '--disable-blink-features=AutomationControlled',
-                '--disable-dev-shm-usage',
-                '--no-sandbox',
-            ]
-        )
+        A context that has served max_navigations is closed and replaced, since
+        Playwright only frees its request/response objects when the context closes.
+        Call between analyses only: pages handed out earlier become invalid.
+        """
+        if self.context and self.browser.is_connected():
+            if self._navigations < self.max_navigations:
+                return
+            logger.info("Recycling browser context after %s navigations", self._navigations)
+            await self.close()
+        
+        self.browser = await get_browser(self.headless)
         
         self.context = await self.browser.new_context(
             viewport={'width': self.viewport_width, 'height': self.viewport_height},
             user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
         )
         
-        await self.context.add_init_script("""
-            Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-        """)
+        await self.context.add_init_script(_STEALTH_JS)
         
         self.context.set_default_timeout(self.timeout)
-        self.page = await self.context.new_page()
+        if self.block_heavy_resources:
+            await self.context.route(_BLOCKED_HOSTS_RE, self._abort)
+        self.page = await self.new_page(block_resources=True)
+        
+        # Worker pages for concurrent analyses
+        self._page_pool = asyncio.Queue()
+        self._pool_pages = []
+        for _ in range(self.pool_size):
+            pool_page = await self.context.new_page()
+            self._pool_pages.append(pool_page)
+            self._page_pool.put_nowait(pool_page)
         
+        self._navigations = 0
         logger.info("Browser initialized")
+    
+    def record_navigation(self) -> None:
+        """Count a navigation made outside navigate() towards context recycling."""
+        self._navigations += 1
+    
+    def release_page(self, page: Page) -> None:
+        """Return a worker page to the pool."""
+        self._page_pool.put_nowait(page)
+    
+    async def new_page(self, block_resources: bool = False) -> Page:
+        """Open a page; pages that won't be screenshotted can skip heavy resources."""
+        page = await self.context.new_page()
+        if block_resources:
+            await page.route('**/*', self._abort_heavy_resources)
+        return page
+    
+    async def _abort_heavy_resources(self, route) -> None:
+        """Abort images, media, fonts and stylesheets."""
+        if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        else:
+            await route.fallback()
+    
+    async def _abort(self, route) -> None:
+        """Abort a request to a known analytics/ad host."""
+        await route.abort()
+    
+    @asynccontextmanager
+    async def acquire_page(self) -> AsyncIterator[Page]:
+        """Borrow a worker page for the duration of the block, waiting if all are busy."""
+        page = await self._page_pool.get()
+        try:
+            yield page
+        finally:
+            # Park the page so the last site's scripts and timers stop while it sits idle
+            try:
+                await page.goto('about:blank')
+            except Exception:
+                pass
+            self.release_page(page)
         
-    async def navigate(self, url: str, retries: int = 2) -> None:
-        """Navigate with error handling and retries."""
+    async def navigate(
+        self,
+        url: str,
+        retries: int = 2,
+        page: Optional[Page] = None,
+        strict: bool = False
+    ) -> Optional[Response]:
+        """
+        Navigate with error handling and retries. Returns the main response.
+        
+        By default waits for DOMContentLoaded plus a short networkidle settle;
+        strict=True waits for full networkidle instead.
+        """
+        page = page or self.page
         last_error = None
+        self.record_navigation()
         
         for attempt in range(retries):
             try:
-                logger.info(f"Navigating to {url} (attempt {attempt + 1}/{retries})")
-                
-                # Try with networkidle first (most reliable but slower)
-                try:
-                    await self.page.goto(url, wait_until='networkidle', timeout=30000)
-                except Exception as e:
-                    logger.warning(f"networkidle failed, trying 'load': {e}")
-                    # Fallback to 'load' (faster, less strict)
-                    await self.page.goto(url, wait_until='load', timeout=20000)
+                logger.info("Navigating to %s (attempt %s/%s)", url, attempt + 1, retries)
                 
-                # Give page time to settle
-                await asyncio.sleep(2)
+                if strict:
+                    response = await page.goto(url, wait_until='networkidle', timeout=self.timeout)
+                else:
+                    response = await page.goto(url, wait_until='domcontentloaded', timeout=self.timeout)
+                    
+                    # Brief settle; analytics/ads often keep the network busy indefinitely
+                    try:
+                        await page.wait_for_load_state('networkidle', timeout=3000)
+                    except PlaywrightTimeoutError:
+                        logger.debug("networkidle not reached for %s, continuing", url)
                 
                 # Dismiss popups
-                await self._dismiss_popups()
+                await self._dismiss_popups(page)
                 
-                logger.info(f"Successfully navigated to {url}")
-                return
+                logger.info("Successfully navigated to %s", url)
+                return response
                 
             except Exception as e:
                 last_error = e
-                logger.warning(f"Navigation attempt {attempt + 1} failed: {e}")
+                logger.warning("Navigation attempt %s failed: %s", attempt + 1, e)
                 
                 if attempt < retries - 1:
-                    logger.info(f"Retrying in 3 seconds...")
+                    logger.info("Retrying in 3 seconds...")
                     await asyncio.sleep(3)
                 else:
-                    logger.error(f"All navigation attempts failed for {url}")
+                    logger.error("All navigation attempts failed for %s", url)
                     raise last_error
     
-    async def _dismiss_popups(self) -> None:
-        """Auto-dismiss cookie banners and popups."""
-        selectors = [
-            'button:has-text("Accept")',
-            'button:has-text("Accept all")',
-            'button:has-text("Accept All")',
-            'button:has-text("I agree")',
-            'button:has-text("I Agree")',
-            '[aria-label*="Accept"]',
-            '[aria-label*="accept"]',
-            'button:has-text("OK")',
-            'button:has-text("Close")',
-            '.cookie-accept',
-            '#cookie-accept',
-            '.accept-cookies'
-        ]
-        
-        for selector in selectors:
-            try:
-                element = self.page.locator(selector).first
-                if await element.is_visible(timeout=2000):
-                    await element.click(timeout=2000)
-                    await asyncio.sleep(0.5)
-                    logger.info(f"Dismissed popup: {selector}")
-                    break
-            except:
-                continue
+    async def _dismiss_popups(self, page: Page) -> None:
+        """Auto-dismiss cookie banners and popups (checked without waiting)."""
+        popups = page.locator(_POPUP_SELECTOR)
+        element = None
+        try:
+            if not await popups.count():
+                return
+            # Pin the matched element; the lazy locator would re-resolve to the next button
+            element = await popups.first.element_handle(timeout=1500)
+            await element.click(timeout=1500)
+            logger.info("Dismissed popup")
+            # Wait for the clicked banner to go away rather than sleeping a fixed time
+            await element.wait_for_element_state('hidden', timeout=1000)
+        except Exception:
+            return
+        finally:
+            if element is not None:
+                with suppress(Exception):
+                    await element.dispose()
     
     async def close(self) -> None:
-        """Clean shutdown."""
+        """Close this manager's context; the shared browser stays up (see shutdown_pool)."""
         try:
+            for pool_page in self._pool_pages:
+                await pool_page.close()
+            self._pool_pages = []
             if self.page:
                 await self.page.close()
             if self.context:
                 await self.context.close()
-            if self.browser:
-                await self.browser.close()
-            if self.playwright:
-                await self.playwright.stop()
-            logger.info("Browser closed")
+            logger.info("Browser context closed")
+            self.page = self.context = self.browser = None
         except Exception as e:
-            logger.error(f"Error closing browser: {e}")
\ No newline at end of file
+            logger.error("Error closing browser context: %s", e)
\ No newline at end of file
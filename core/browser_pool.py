@@ -0,0 +1,90 @@
+"""
+Shared Chromium instances reused across browser managers.
+"""
+import asyncio
+import weakref
+from typing import Dict, Optional
+from playwright.async_api import async_playwright, Browser, Playwright
+import logging
+
+logger = logging.getLogger(__name__)
+
+_LAUNCH_ARGS = (
+    '--disable-blink-features=AutomationControlled',
+    '--disable-dev-shm-usage',
+    '--no-sandbox',
+    '--disable-gpu',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-features=Translate,BackForwardCache,IsolateOrigins,site-per-process',
+    '--renderer-process-limit=2',
+)
+
+
+class _Pool:
+    """Playwright driver and browsers owned by one event loop."""
+    
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.playwright: Optional[Playwright] = None
+        self.browsers: Dict[bool, Browser] = {}
+
+
+# Playwright objects are bound to the loop that created them, so the pool is per loop
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _Pool]" = weakref.WeakKeyDictionary()
+
+
+def _current_pool() -> _Pool:
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = _Pool()
+    return pool
+
+
+async def get_browser(headless: bool = True) -> Browser:
+    """Return the shared browser, launching it on first use."""
+    pool = _current_pool()
+    
+    async with pool.lock:
+        browser = pool.browsers.get(headless)
+        if browser and browser.is_connected():
+            return browser
+        
+        if pool.playwright is None:
+            pool.playwright = await async_playwright().start()
+        
+        browser = await pool.playwright.chromium.launch(
+            headless=headless,
+            args=list(_LAUNCH_ARGS)
+        )
+        pool.browsers[headless] = browser
+        
+        logger.info("Shared browser launched")
+        return browser
+
+
+async def shutdown_pool(headless: Optional[bool] = None) -> None:
+    """
+    Close the shared browsers and stop Playwright (call on application exit).
+    
+    With headless given, only that mode's browser is closed; Playwright stops
+    once no browser is left.
+    """
+    pool = _pools.get(asyncio.get_running_loop())
+    if pool is None:
+        return
+    
+    async with pool.lock:
+        try:
+            modes = list(pool.browsers) if headless is None else [headless]
+            for mode in modes:
+                browser = pool.browsers.pop(mode, None)
+                if browser:
+                    await browser.close()
+            if pool.playwright and not pool.browsers:
+                await pool.playwright.stop()
+                pool.playwright = None
+            logger.info("Shared browser closed")
+        except Exception as e:
+            logger.error("Error closing shared browser: %s", e)
@@ -2,22 +2,41 @@
 LLM-powered functional specification extractor.
 """
 import base64
-import json
+import hashlib
+import io
+import os
+import random
 import re
+import tempfile
+import time
 import asyncio
-from typing import Dict, Any
+import httpx
+import orjson
+from contextlib import aclosing, suppress
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
-from bs4 import BeautifulSoup
 from playwright.async_api import Page
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
 import logging
 
 from config import settings
+from .http_client import new_http_client
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; screenshots are then sent at full size
+    Image = None
+
+try:
+    import tiktoken
+except ImportError:  # Installed with langchain-openai; otherwise tokens are estimated
+    tiktoken = None
 
 logger = logging.getLogger(__name__)
 
 
+# Static instructions, sent first so providers can cache the prompt prefix
 REVERSE_ENGINEERING_PROMPT = """You are a Replication Engineer analyzing web pages to create implementation blueprints.
 
 **YOUR GOAL:** Extract precise specifications that allow a developer to recreate this page from scratch.
@@ -50,30 +69,32 @@ REVERSE_ENGINEERING_PROMPT = """You are a Replication Engineer analyzing web pag
 
 **OUTPUT SCHEMA:**
 ```json
-{{
+{
   "template_name": "Homepage | Product Detail | Category Listing | etc",
   "layout_engine": "CSS Grid | Flexbox | etc",
-  "design_system": {{
+  "design_system": {
     "primary_color": "#RRGGBB",
     "secondary_color": "#RRGGBB or null",
     "background_color": "#RRGGBB",
     "text_color": "#RRGGBB",
     "font_family": "Font Name, fallback",
     "button_style": "detailed description"
-  }},
+  },
   "components": [
-    {{
+    {
       "name": "Component Name",
       "location": "where it appears",
       "functionality": "what it does",
       "data_inputs": ["field descriptions"],
       "trigger_events": ["interaction descriptions"]
-    }}
+    }
   ]
-}}
+}
 ```
+"""
 
-**DOM CONTEXT:**
+# Per-page input, sent after the cached prefix together with the screenshot
+PAGE_CONTEXT_PROMPT = """**DOM CONTEXT:**
 {dom}
 
 **URL:**
@@ -82,132 +103,406 @@ REVERSE_ENGINEERING_PROMPT = """You are a Replication Engineer analyzing web pag
 Analyze the screenshot and DOM to produce the replication blueprint JSON.
 """
 
+# Bump whenever the prompts or the DOM summary change so cached specs are invalidated
+PROMPT_VERSION = "v6"
+
+# Title phrases that mark an error page on their own ("404" only as a whole word)
+_NOT_FOUND_RE = re.compile(r'\b404\b|' + '|'.join(map(re.escape, (
+    'not found',
+    "page can't be found",
+    'page could not be found',
+    'page does not exist',
+    "couldn't find",
+    "can't find that page"
+))))
+
+# Weaker title hints, trusted only when the page is nearly empty
+_ERROR_HINT_RE = re.compile('|'.join(map(re.escape, ('error', 'oops', "can't find", 'does not exist'))))
+_MIN_DOM_CHARS = 500
+
+# DOM summaries shorter than this (title line included) are skipped as empty pages
+_MIN_CONTENT_CHARS = 200
+
+# Soft 404s served with 200: only the leading h1/h2 lines of a small summary are checked
+_SOFT_404_RE = re.compile(r'\b404\b')
+_SOFT_404_HEADINGS = 2
+
+# Upper bound for any rate-limit wait, whether from Retry-After or backoff
+_MAX_RETRY_DELAY = 60.0
+
+# Digit runs (prices, counts, dates, ids) are masked when keying cached responses
+_DIGITS_RE = re.compile(r'\d+')
+
+# In-page DOM summary lines: title, headings, forms and the first 30 controls.
+# The control budget goes to the template type's focus elements first; hrefs lose
+# their query string and repeated controls are dropped. The raw title comes back
+# alongside so capture() needs no separate page.title() round trip.
+_DOM_JS = """
+(focus) => {
+    const title = document.title;
+    const out = [];
+    out.push(`<title>${title}</title>`);
+    for (const h of document.querySelectorAll('h1, h2, h3')) {
+        const tag = h.tagName.toLowerCase();
+        out.push(`<${tag}>${h.textContent.slice(0, 100)}</${tag}>`);
+    }
+    for (const f of document.querySelectorAll('form')) {
+        out.push(`<form action='${f.getAttribute('action') || ''}' method='${f.getAttribute('method') || 'GET'}'>`);
+        for (const i of f.querySelectorAll('input, select')) {
+            out.push(`  <input type='${i.getAttribute('type') || 'text'}' name='${i.getAttribute('name') || ''}'>`);
+        }
+        out.push('</form>');
+    }
+    const seen = new Set();
+    const emitted = new Set();
+    let n = 0;
+    for (const selector of focus ? [focus, 'button, a'] : ['button, a']) {
+        const controls = document.querySelectorAll(selector);
+        for (let i = 0; i < controls.length && n < 30; i++) {
+            const b = controls[i];
+            if (seen.has(b)) continue;
+            seen.add(b);
+            n++;
+            const text = b.textContent.trim().slice(0, 50);
+            if (text) {
+                const tag = b.tagName.toLowerCase();
+                const href = b.getAttribute('href');
+                const line = href === null ? `<${tag}>${text}</${tag}>` : `<${tag} href='${href.split(/[?#]/)[0]}'>${text}</${tag}>`;
+                if (!emitted.has(line)) {
+                    emitted.add(line);
+                    out.push(line);
+                }
+            }
+        }
+    }
+    return {title, lines: out};
+}
+"""
+
+# Elements worth the control budget for each template type (see TemplateDetector._infer_type)
+_DOM_FOCUS = {
+    'homepage': 'nav a, header a, [class*="hero"] a, [class*="hero"] button',
+    'product': '[itemprop="price"], [class*="price"], button[type="submit"], [class*="cart"] button, [class*="cart"] a',
+    'category': '[class*="filter"] a, [class*="filter"] button, [class*="sort"] button, [class*="pagination"] a',
+    'article': 'time, [rel="author"], [class*="author"], [class*="share"] a',
+    'search': '[class*="filter"] a, [class*="filter"] button, [class*="result"] a',
+    'checkout': 'button[type="submit"], [class*="total"], [class*="summary"] a',
+    'auth': 'button[type="submit"], a[href*="forgot"], a[href*="login"], a[href*="signup"], a[href*="register"]',
+}
+
+
+@lru_cache(maxsize=1)
+def _load_encoding():
+    """Tokenizer for the configured model, or None if tiktoken can't load it (e.g. offline)."""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(settings.llm_model)
+        except KeyError:
+            return tiktoken.get_encoding('o200k_base')
+    except Exception as e:
+        logger.warning("Tokenizer unavailable, estimating DOM tokens: %s", e)
+        return None
+
 
 class FunctionalAnalyzer:
     """Reverse engineering analysis engine."""
     
-    def __init__(self):
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        # Imported here: langchain_openai pulls in the whole openai SDK (~0.8s), which
+        # would otherwise delay the first UI render just for importing core
+        from langchain_openai import ChatOpenAI
+        
+        # One pooled client shared by all concurrent LLM calls (owned unless passed in)
+        self._owns_http = http_client is None
+        self._http = http_client or new_http_client()
         self.llm = ChatOpenAI(
             model=settings.llm_model,
             temperature=settings.llm_temperature,
             max_tokens=settings.llm_max_tokens,
-            api_key=settings.openai_api_key
+            api_key=settings.openai_api_key,
+            http_async_client=self._http,
+            # JSON mode: the reply is a bare object, no fences or preamble to strip
+            model_kwargs={'response_format': {'type': 'json_object'}}
         )
+        self._llm_slots = asyncio.Semaphore(settings.openai_max_concurrency)
+    
+    async def aclose(self) -> None:
+        """Close the pooled LLM HTTP client, unless it was passed in."""
+        if self._owns_http:
+            await self._http.aclose()
     
-    async def analyze(self, page: Page, template_pattern: str, output_dir: Path) -> Dict[str, Any]:
+    async def analyze(
+        self,
+        page: Page,
+        template_pattern: str,
+        output_dir: Path,
+        template_type: Optional[str] = None,
+        status: int = 0
+    ) -> Dict[str, Any]:
         """Analyze page and return blueprint data."""
+        capture = await self.capture(page, template_pattern, output_dir, template_type, status)
+        return await self.complete(capture)
+    
+    async def capture(
+        self,
+        page: Page,
+        template_pattern: str,
+        output_dir: Path,
+        template_type: Optional[str] = None,
+        status: int = 0
+    ) -> Dict[str, Any]:
+        """
+        Capture the page state the LLM needs.
+        
+        status is the HTTP status of the navigation (0 if unknown). Returns a
+        capture for complete(), or a finished spec if the page is skipped or
+        capture fails. The page can be reused once this returns.
+        """
+        url = page.url
         try:
-            logger.info(f"Analyzing: {template_pattern}")
+            logger.info("Analyzing: %s", template_pattern)
             
-            # Check if page is a 404 error
-            url = page.url
-            title = await page.title()
+            # Check if page is a 404 error (the DOM summary is cheap, the screenshot is not)
+            title, dom = await self._extract_dom(page, template_type)
             
-            # Detect 404 pages
-            if self._is_404_page(title, url):
-                logger.warning(f"Skipping 404 page: {url}")
-                return {
-                    'template_name': '404 Error Page (Skipped)',
-                    'template_pattern': template_pattern,
-                    'layout_engine': 'N/A',
-                    'design_system': {
-                        'primary_color': '#000000',
-                        'background_color': '#ffffff',
-                        'text_color': '#000000',
-                        'font_family': 'N/A',
-                        'button_style': 'N/A'
-                    },
-                    'components': [],
-                    'analyzed_url': url,
-                    'status': 'skipped',
-                    'error_message': 'Page is a 404 error page'
-                }
+            if self._is_404_page(title, dom, status):
+                logger.warning("Skipping 404 page: %s", url)
+                return self._skipped_spec(template_pattern, url, '404 Error Page (Skipped)', 'Page is a 404 error page')
             
-            # Capture state
-            screenshot_b64 = await self._capture_screenshot(page)
-            dom = await self._extract_dom(page)
+            # Blank or near-empty pages (about:blank, failed renders) have nothing to analyze
+            if len(dom.strip()) < _MIN_CONTENT_CHARS:
+                logger.info("Skipping empty page: %s", url)
+                return self._skipped_spec(template_pattern, url, 'Empty Page (Skipped)', 'Page has almost no content')
             
-            # Save screenshot
-            screenshot_path = output_dir / f"screenshot_{template_pattern.replace('/', '_')}.png"
-            screenshot_bytes = base64.b64decode(screenshot_b64)
-            screenshot_path.write_bytes(screenshot_bytes)
+            # Capture state (screenshot is written to disk by the browser)
+            screenshot_path = output_dir / f"screenshot_{template_pattern.replace('/', '_')}.jpg"
+            screenshot = await self._capture_screenshot(page, screenshot_path)
+            llm_image = await asyncio.to_thread(self._downscale_for_llm, screenshot)
+            response_key = await asyncio.to_thread(self._response_key, template_pattern, dom, llm_image)
             
-            # Analyze with LLM (with retry for rate limits)
-            spec_data = await self._analyze_with_retry(screenshot_b64, dom, url)
+            return {
+                'template_pattern': template_pattern,
+                'analyzed_url': url,
+                'screenshot_path': str(screenshot_path.relative_to(output_dir.parent)),
+                'screenshot_b64': base64.b64encode(llm_image).decode('ascii'),
+                'dom': dom,
+                'response_key': response_key,
+                'status': 'captured'
+            }
+            
+        except Exception as e:
+            logger.error("Analysis failed: %s", e)
+            return self._failed_spec(template_pattern, url, e)
+    
+    async def complete(self, capture: Dict[str, Any]) -> Dict[str, Any]:
+        """Run the LLM over a capture and return blueprint data."""
+        if capture['status'] != 'captured':
+            return capture
+        
+        try:
+            # Near-identical pages of a template reuse the stored response
+            spec_data = await asyncio.to_thread(self._read_cache, capture['response_key'])
+            
+            if spec_data is None:
+                # Analyze with LLM (with retry for rate limits)
+                async with self._llm_slots:
+                    spec_data = await self._analyze_with_retry(
+                        capture['screenshot_b64'],
+                        capture['dom'],
+                        capture['analyzed_url']
+                    )
+                await asyncio.to_thread(self._write_cache, capture['response_key'], spec_data)
             
             # Add metadata
-            spec_data['template_pattern'] = template_pattern
-            spec_data['analyzed_url'] = url
-            spec_data['screenshot_path'] = str(screenshot_path.relative_to(output_dir.parent))
+            spec_data['template_pattern'] = capture['template_pattern']
+            spec_data['analyzed_url'] = capture['analyzed_url']
+            spec_data['screenshot_path'] = capture['screenshot_path']
             spec_data['status'] = 'success'
             
             return spec_data
             
         except Exception as e:
-            logger.error(f"Analysis failed: {e}")
-            # Return failed spec
-            return {
-                'template_name': 'unknown',
-                'template_pattern': template_pattern,
-                'layout_engine': 'unknown',
-                'design_system': {
-                    'primary_color': '#000000',
-                    'background_color': '#ffffff',
-                    'text_color': '#000000',
-                    'font_family': 'unknown',
-                    'button_style': 'unknown'
-                },
-                'components': [],
-                'analyzed_url': page.url,
-                'status': 'failed',
-                'error_message': str(e)
-            }
+            logger.error("Analysis failed: %s", e)
+            return self._failed_spec(capture['template_pattern'], capture['analyzed_url'], e)
+    
+    def cached_spec(self, url: str, template_pattern: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the stored spec for this URL and template, if any.
+        
+        The URL alone says nothing about whether the page changed, so specs
+        older than spec_cache_max_age_hours are re-analyzed.
+        """
+        return self._read_cache(f"{template_pattern}|{url}", max_age=settings.spec_cache_max_age_hours * 3600)
+    
+    def store_spec(self, url: str, template_pattern: str, spec: Dict[str, Any]) -> None:
+        """Persist a successful spec."""
+        if spec.get('status') == 'success':
+            self._write_cache(f"{template_pattern}|{url}", spec)
+    
+    def _response_key(self, template_pattern: str, dom: str, image: bytes) -> str:
+        """
+        Cache key for an LLM response: template, DOM summary and screenshot hash.
+        
+        Numbers in the DOM are masked so pages that differ only in prices,
+        counts or dates share a response.
+        """
+        dom_hash = hashlib.blake2b(_DIGITS_RE.sub('0', dom).encode(), digest_size=16).hexdigest()
+        return f"{template_pattern}|dom:{dom_hash}|img:{self._image_hash(image)}"
+    
+    def _image_hash(self, image: bytes) -> str:
+        """Difference hash of the screenshot, so near-identical renders share a key."""
+        if Image is None:
+            return hashlib.blake2b(image, digest_size=16).hexdigest()
+        
+        pixels = Image.open(io.BytesIO(image)).convert('L').resize((17, 16)).load()
+        bits = 0
+        for y in range(16):
+            for x in range(16):
+                bits = (bits << 1) | (pixels[x, y] > pixels[x + 1, y])
+        return f"{bits:064x}"
+    
+    def _read_cache(self, key: str, max_age: float = 0) -> Optional[Dict[str, Any]]:
+        """
+        Load a cached entry, or None on a miss, past max_age seconds (0 = no limit) or with caching disabled.
+        
+        Best effort: an unreadable or corrupt entry counts as a miss.
+        """
+        if not settings.use_spec_cache:
+            return None
+        path = self._cache_path(key)
+        try:
+            if max_age and time.time() - path.stat().st_mtime > max_age:
+                return None
+            return orjson.loads(path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, orjson.JSONDecodeError) as e:
+            logger.debug("Cache read failed for %s: %s", path.name, e)
+            return None
+    
+    def _write_cache(self, key: str, data: Dict[str, Any]) -> None:
+        """
+        Persist a cache entry (written to a temp file, then swapped in).
+        
+        Best effort: a failed write is logged and never fails the analysis.
+        """
+        if not settings.use_spec_cache:
+            return
+        path = self._cache_path(key)
+        tmp_name = None
+        try:
+            # Unique temp name, so concurrent writers of the same key can't clobber each other
+            with tempfile.NamedTemporaryFile(dir=path.parent, suffix='.tmp', delete=False) as tmp:
+                tmp_name = tmp.name
+                tmp.write(orjson.dumps(data))
+            os.replace(tmp_name, path)
+        except OSError as e:
+            logger.warning("Cache write failed for %s: %s", path.name, e)
+            if tmp_name:
+                with suppress(OSError):
+                    os.unlink(tmp_name)
+    
+    def _cache_path(self, key: str) -> Path:
+        """Cache file for a key, scoped to the LLM, image and DOM settings and the prompt version."""
+        key = (
+            f"{key}|{settings.llm_model}|{settings.llm_temperature}|{settings.llm_max_tokens}"
+            f"|{settings.llm_image_detail}|{settings.llm_image_max_edge}|{settings.screenshot_quality}"
+            f"|{settings.llm_dom_token_budget}|{PROMPT_VERSION}"
+        )
+        digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        return settings.cache_dir / f"{digest}.json"
+    
+    def _skipped_spec(self, template_pattern: str, url: str, template_name: str, reason: str) -> Dict[str, Any]:
+        """Placeholder spec for a page skipped without an LLM call."""
+        return {
+            'template_name': template_name,
+            'template_pattern': template_pattern,
+            'layout_engine': 'N/A',
+            'design_system': {
+                'primary_color': '#000000',
+                'background_color': '#ffffff',
+                'text_color': '#000000',
+                'font_family': 'N/A',
+                'button_style': 'N/A'
+            },
+            'components': [],
+            'analyzed_url': url,
+            'status': 'skipped',
+            'error_message': reason
+        }
     
-    def _is_404_page(self, title: str, url: str) -> bool:
-        """Detect if page is a 404 error page."""
+    def _failed_spec(self, template_pattern: str, url: str, error: Exception) -> Dict[str, Any]:
+        """Placeholder spec for a template whose analysis failed."""
+        return {
+            'template_name': 'unknown',
+            'template_pattern': template_pattern,
+            'layout_engine': 'unknown',
+            'design_system': {
+                'primary_color': '#000000',
+                'background_color': '#ffffff',
+                'text_color': '#000000',
+                'font_family': 'unknown',
+                'button_style': 'unknown'
+            },
+            'components': [],
+            'analyzed_url': url,
+            'status': 'failed',
+            'error_message': str(error)
+        }
+    
+    def _is_404_page(self, title: str, dom: str, status: int = 0) -> bool:
+        """Detect error pages from the HTTP status, title and DOM summary."""
+        if status >= 400:
+            return True
+        
         title_lower = title.lower()
+        if _NOT_FOUND_RE.search(title_lower):
+            return True
         
-        # Common 404 indicators in title
-        error_keywords = [
-            '404',
-            'not found',
-            'page not found',
-            'error',
-            'oops',
-            "can't find",
-            'does not exist'
-        ]
+        # Anything below is only trusted on a nearly empty page; links and body
+        # text on a full page can mention 404s or errors without being one
+        if len(dom) >= _MIN_DOM_CHARS:
+            return False
         
-        return any(keyword in title_lower for keyword in error_keywords)
+        # Soft 404s served with 200 (leading heading such as "404 - Page not found")
+        headings = [line.lower() for line in dom.split('\n') if line.startswith(('<h1>', '<h2>'))]
+        for heading in headings[:_SOFT_404_HEADINGS]:
+            if _SOFT_404_RE.search(heading) and ('not found' in heading or 'error' in heading):
+                return True
+        
+        return bool(_ERROR_HINT_RE.search(title_lower))
     
     async def _analyze_with_retry(self, screenshot_b64: str, dom: str, url: str, max_retries: int = 3) -> Dict:
         """Analyze with LLM with retry logic for rate limits."""
-        prompt = REVERSE_ENGINEERING_PROMPT.format(dom=dom, url=url)
+        prompt = PAGE_CONTEXT_PROMPT.format(dom=dom, url=url)
         
         for attempt in range(max_retries):
             try:
-                response = await self.llm.ainvoke([
+                return await self._stream_json([
+                    SystemMessage(content=REVERSE_ENGINEERING_PROMPT),
                     HumanMessage(content=[
                         {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{screenshot_b64}"}}
+                        {"type": "image_url", "image_url": {
+                            "url": f"data:image/jpeg;base64,{screenshot_b64}",
+                            "detail": settings.llm_image_detail
+                        }}
                     ])
                 ])
                 
-                # Parse JSON
-                return self._extract_json(response.content)
-                
             except Exception as e:
                 error_str = str(e)
                 
                 # Check if it's a rate limit error
                 if '429' in error_str or 'rate_limit' in error_str.lower():
                     if attempt < max_retries - 1:
-                        wait_time = (attempt + 1) * 10  # 10s, 20s, 30s
-                        logger.warning(f"Rate limit hit, waiting {wait_time}s before retry {attempt + 2}/{max_retries}")
+                        wait_time = self._retry_delay(e, attempt)
+                        logger.warning("Rate limit hit, waiting %.1fs before retry %s/%s", wait_time, attempt + 2, max_retries)
                         await asyncio.sleep(wait_time)
                         continue
                     else:
-                        logger.error(f"Rate limit exceeded after {max_retries} attempts")
+                        logger.error("Rate limit exceeded after %s attempts", max_retries)
                         raise
                 else:
                     # Not a rate limit error, don't retry
@@ -215,49 +510,107 @@ class FunctionalAnalyzer:
         
         raise Exception("Failed after all retries")
     
-    async def _capture_screenshot(self, page: Page) -> str:
-        """Capture and encode screenshot."""
-        screenshot = await page.screenshot(full_page=False, type='png')
-        return base64.b64encode(screenshot).decode()
-    
-    async def _extract_dom(self, page: Page) -> str:
-        """Simplify DOM for analysis."""
-        html = await page.content()
-        soup = BeautifulSoup(html, 'lxml')
-        
-        for tag in soup(['script', 'style', 'noscript', 'svg']):
-            tag.decompose()
-        
+    async def _stream_json(self, messages: list) -> Dict[str, Any]:
+        """Stream the completion and parse it as soon as the top-level JSON object closes."""
         parts = []
+        depth = 0
+        in_string = escaped = False
+        
+        async with aclosing(self.llm.astream(messages)) as stream:
+            async for chunk in stream:
+                content = chunk.content
+                parts.append(content)
+                for i, ch in enumerate(content):
+                    if in_string:
+                        if escaped:
+                            escaped = False
+                        elif ch == '\\':
+                            escaped = True
+                        elif ch == '"':
+                            in_string = False
+                    elif ch == '"' and depth:
+                        in_string = True
+                    elif ch == '{':
+                        depth += 1
+                    elif ch == '}' and depth:
+                        depth -= 1
+                        if depth == 0:
+                            # Stop the stream; anything after the object is discarded anyway
+                            text = ''.join(parts)
+                            return self._extract_json(text[:len(text) - len(content) + i + 1])
         
-        if soup.title:
-            parts.append(f"<title>{soup.title.string}</title>")
+        return self._extract_json(''.join(parts))
+    
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """
+        Server Retry-After if given, else exponential backoff with full jitter (10s, 20s, ...).
         
-        for h in soup.find_all(['h1', 'h2', 'h3']):
-            parts.append(f"<{h.name}>{h.get_text()[:100]}</{h.name}>")
+        Either way the wait is kept within 0-60s: the worker holds an LLM slot
+        and a template slot while it sleeps.
+        """
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = random.uniform(0, min(_MAX_RETRY_DELAY, 10 * 2 ** attempt))
+        if delay != delay:  # NaN
+            delay = 0.0
+        return min(max(delay, 0.0), _MAX_RETRY_DELAY)
+    
+    async def _capture_screenshot(self, page: Page, path: Path) -> bytes:
+        """Capture a JPEG screenshot to disk and return its bytes."""
+        return await page.screenshot(
+            path=str(path),
+            full_page=False,
+            type='jpeg',
+            quality=settings.screenshot_quality
+        )
+    
+    def _downscale_for_llm(self, screenshot: bytes) -> bytes:
+        """Shrink the screenshot to llm_image_max_edge; image tokens scale with pixel area."""
+        max_edge = settings.llm_image_max_edge
+        if Image is None or max_edge <= 0:
+            return screenshot
         
-        for form in soup.find_all('form'):
-            parts.append(f"<form action='{form.get('action', '')}' method='{form.get('method', 'GET')}'>")
-            for inp in form.find_all(['input', 'select']):
-                parts.append(f"  <input type='{inp.get('type', 'text')}' name='{inp.get('name', '')}'>")
-            parts.append("</form>")
+        image = Image.open(io.BytesIO(screenshot))
+        if max(image.size) <= max_edge:
+            return screenshot
         
-        for btn in soup.find_all(['button', 'a'])[:30]:
-            text = btn.get_text()[:50]
-            if text:
-                parts.append(f"<{btn.name} href='{btn.get('href', '')}'>{text}</{btn.name}>")
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, 'JPEG', quality=settings.screenshot_quality, optimize=True)
+        return buffer.getvalue()
+    
+    async def _extract_dom(self, page: Page, template_type: Optional[str] = None) -> Tuple[str, str]:
+        """Page title and simplified DOM in one evaluate (only the summary crosses CDP)."""
+        summary = await page.evaluate(_DOM_JS, _DOM_FOCUS.get(template_type))
+        dom = await asyncio.to_thread(self._fit_token_budget, summary['lines'])
+        return summary['title'], dom
+    
+    def _fit_token_budget(self, lines: List[str]) -> str:
+        """Keep whole summary lines, in order, within llm_dom_token_budget."""
+        encoding = _load_encoding()
+        if encoding is not None:
+            counts = [len(tokens) for tokens in encoding.encode_batch(lines)]
+        else:
+            counts = [len(line) // 4 + 1 for line in lines]
         
-        return '\n'.join(parts)[:6000]
+        budget = settings.llm_dom_token_budget
+        kept = []
+        for line, count in zip(lines, counts):
+            budget -= count + 1  # +1 for the joining newline
+            if budget < 0:
+                break
+            kept.append(line)
+        return '\n'.join(kept)
     
     def _extract_json(self, text: str) -> Dict[str, Any]:
-        """Extract JSON from response."""
-        text = re.sub(r'```json\s*', '', text)
-        text = re.sub(r'```\s*', '', text).strip()
-        
+        """Parse the JSON object from the response (the brace slice guards against stray text)."""
         start = text.find('{')
         end = text.rfind('}') + 1
         
         if start >= 0 and end > start:
-            return json.loads(text[start:end])
+            return orjson.loads(text[start:end])
         
         raise ValueError("No valid JSON in response")
\ No newline at end of file
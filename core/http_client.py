@@ -0,0 +1,16 @@
+"""
+Pooled HTTP client shared by URL discovery and the LLM client.
+"""
+import importlib.util
+import httpx
+
+# HTTP/2 needs the optional h2 package (httpx[http2]); fall back to HTTP/1.1 keep-alive
+_HTTP2 = importlib.util.find_spec('h2') is not None
+
+
+def new_http_client() -> httpx.AsyncClient:
+    """Keep-alive connection pool (HTTP/2 when available) for all outbound requests."""
+    return httpx.AsyncClient(
+        http2=_HTTP2,
+        limits=httpx.Limits(max_keepalive_connections=16, max_connections=32)
+    )
@@ -2,114 +2,172 @@
 Intelligent URL discovery engine.
 """
 import asyncio
-import re
-from typing import List, Set
-from urllib.parse import urljoin, urlparse
+import io
+import httpx
+from typing import List, Optional, Set
+from urllib.parse import urljoin, urlparse, urlsplit
 from playwright.async_api import Page
-import xml.etree.ElementTree as ET
+from lxml import etree
 import logging
 
+from .browser_manager import BrowserManager
+
 logger = logging.getLogger(__name__)
 
+# Pages visited by the fallback crawl, across all depths
+_MAX_CRAWL_PAGES = 15
+
+_LINKS_JS = """
+() => Array.from(document.querySelectorAll('a[href]'))
+        .map(a => a.href)
+        .filter(h => h.startsWith('http'))
+"""
+
+_SITEMAP_PATHS = ('/sitemap.xml', '/sitemap_index.xml', '/sitemap-index.xml')
+
+# Same browser identity as BrowserManager; some hosts refuse non-browser clients
+_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+}
+
 
 class SitemapCrawler:
     """Discovers URLs via sitemap and intelligent crawling."""
     
-    def __init__(self, max_urls: int = 500):
+    def __init__(
+        self,
+        max_urls: int = 500,
+        max_depth: int = 2,
+        concurrency: int = 4,
+        http_client: Optional[httpx.AsyncClient] = None
+    ):
         self.max_urls = max_urls
+        self.max_depth = max_depth
+        self.concurrency = concurrency
+        self.http_client = http_client
         self.discovered_urls: Set[str] = set()
         
-    async def discover_urls(self, page: Page, base_url: str) -> List[str]:
-        """Main discovery orchestration."""
-        logger.info(f"Starting URL discovery for {base_url}")
+    async def discover_urls(self, browser: BrowserManager, base_url: str) -> List[str]:
+        """Main discovery orchestration (the fallback crawl runs on the browser's pages)."""
+        logger.info("Starting URL discovery for %s", base_url)
+        self.discovered_urls = set()
         
         # Try sitemap first
-        sitemap_urls = await self._fetch_sitemap(page, base_url)
+        sitemap_urls = await self._fetch_sitemap(base_url)
         self.discovered_urls.update(sitemap_urls)
         
         # Fallback to crawling if needed
         if len(self.discovered_urls) < 20:
             logger.info("Sitemap insufficient, initiating crawl")
-            crawled = await self._crawl_links(page, base_url)
+            crawled = await self._crawl_links(browser, base_url, self.max_depth)
             self.discovered_urls.update(crawled)
         
         result = list(self.discovered_urls)[:self.max_urls]
-        logger.info(f"Discovered {len(result)} URLs")
+        logger.info("Discovered %s URLs", len(result))
         return result
     
-    async def _fetch_sitemap(self, page: Page, base_url: str) -> Set[str]:
-        """Parse sitemap.xml."""
+    async def _fetch_sitemap(self, base_url: str) -> Set[str]:
+        """Parse sitemap.xml (plain HTTP, all candidate paths fetched concurrently)."""
         urls = set()
-        sitemap_paths = ['/sitemap.xml', '/sitemap_index.xml', '/sitemap-index.xml']
         
-        for path in sitemap_paths:
-            sitemap_url = urljoin(base_url, path)
-            try:
-                response = await page.goto(sitemap_url, wait_until='load', timeout=10000)
-                if response and response.status == 200:
-                    content = await page.content()
-                    parsed = self._parse_sitemap_xml(content, base_url)
-                    urls.update(parsed)
-                    logger.info(f"Found {len(parsed)} URLs in {path}")
-                    if len(urls) > 100:
-                        break
-            except:
+        if self.http_client is not None:
+            responses = await self._get_sitemaps(self.http_client, base_url)
+        else:
+            async with httpx.AsyncClient() as client:
+                responses = await self._get_sitemaps(client, base_url)
+        
+        for path, response in zip(_SITEMAP_PATHS, responses):
+            if isinstance(response, Exception) or response.status_code != 200:
                 continue
+            parsed = self._parse_sitemap_xml(response.content, base_url)
+            urls.update(parsed)
+            logger.info("Found %s URLs in %s", len(parsed), path)
         
         return urls
     
-    def _parse_sitemap_xml(self, xml_content: str, base_url: str) -> Set[str]:
-        """Extract URLs from sitemap XML."""
+    async def _get_sitemaps(self, client: httpx.AsyncClient, base_url: str) -> list:
+        """GET every candidate sitemap path at once; failures come back as exceptions."""
+        return await asyncio.gather(
+            *(
+                client.get(urljoin(base_url, path), headers=_HEADERS, timeout=10, follow_redirects=True)
+                for path in _SITEMAP_PATHS
+            ),
+            return_exceptions=True
+        )
+    
+    def _parse_sitemap_xml(self, xml_content: bytes, base_url: str) -> Set[str]:
+        """Extract URLs from sitemap XML (streamed, in any namespace)."""
         urls = set()
         try:
-            xml_content = re.sub(r' xmlns="[^"]+"', '', xml_content)
-            root = ET.fromstring(xml_content)
             base_domain = urlparse(base_url).netloc
             
-            for loc in root.findall('.//loc'):
+            for _, loc in etree.iterparse(io.BytesIO(xml_content), tag='{*}loc', recover=True):
                 if loc.text:
                     url = loc.text.strip()
-                    if urlparse(url).netloc == base_domain:
+                    if urlsplit(url).netloc == base_domain:
                         urls.add(url)
+                
+                # Drop finished entries so memory stays flat on large sitemaps
+                entry = loc.getparent()
+                loc.clear()
+                if entry is not None:
+                    while entry.getprevious() is not None:
+                        del entry.getparent()[0]
         except Exception as e:
-            logger.debug(f"XML parse error: {e}")
+            logger.debug("XML parse error: %s", e)
         
         return urls
     
-    async def _crawl_links(self, page: Page, base_url: str, max_depth: int = 2) -> Set[str]:
-        """Crawl internal links."""
-        visited = set()
-        to_visit = {base_url}
+    async def _crawl_links(self, browser: BrowserManager, base_url: str, max_depth: int = 2) -> Set[str]:
+        """Crawl internal links breadth-first, one level at a time on concurrent pages."""
         urls = set()
+        visited = set()
         base_domain = urlparse(base_url).netloc
-        depth = 0
         
-        while to_visit and depth < max_depth and len(urls) < self.max_urls:
-            current = to_visit.pop()
-            if current in visited:
-                continue
-            
-            visited.add(current)
-            
+        # The crawl page plus extra pages; none are screenshotted, so all skip heavy resources
+        pages = [browser.page] + [
+            await browser.new_page(block_resources=True) for _ in range(self.concurrency - 1)
+        ]
+        idle = asyncio.Queue()
+        for worker_page in pages:
+            idle.put_nowait(worker_page)
+        
+        async def fetch(url: str) -> List[str]:
+            worker_page = await idle.get()
             try:
-                await page.goto(current, wait_until='networkidle', timeout=15000)
-                await asyncio.sleep(0.5)
-                
-                links = await page.evaluate("""
-                    () => Array.from(document.querySelectorAll('a[href]'))
-                            .map(a => a.href)
-                            .filter(h => h.startsWith('http'))
-                """)
+                browser.record_navigation()
+                return await self._page_links(worker_page, url)
+            except Exception as e:
+                logger.debug("Crawl failed for %s: %s", url, e)
+                return []
+            finally:
+                idle.put_nowait(worker_page)
+        
+        try:
+            frontier = [base_url]
+            for _ in range(max_depth):
+                frontier = [url for url in frontier if url not in visited][:_MAX_CRAWL_PAGES - len(visited)]
+                if not frontier or len(urls) >= self.max_urls:
+                    break
+                visited.update(frontier)
                 
-                for link in links:
-                    if urlparse(link).netloc == base_domain:
-                        clean = f"{urlparse(link).scheme}://{urlparse(link).netloc}{urlparse(link).path}"
-                        urls.add(clean)
-                        if len(visited) < 15:
-                            to_visit.add(clean)
-            except:
-                continue
-            
-            depth += 1
+                next_frontier = []
+                for links in await asyncio.gather(*(fetch(url) for url in frontier)):
+                    for link in links:
+                        parts = urlparse(link)
+                        if parts.netloc == base_domain:
+                            clean = f"{parts.scheme}://{parts.netloc}{parts.path}"
+                            if clean not in urls:
+                                urls.add(clean)
+                                next_frontier.append(clean)
+                frontier = next_frontier
+        finally:
+            for worker_page in pages[1:]:
+                await worker_page.close()
         
-        return urls
\ No newline at end of file
+        return urls
+    
+    async def _page_links(self, page: Page, url: str) -> List[str]:
+        """Load a page and return its absolute links."""
+        await page.goto(url, wait_until='domcontentloaded', timeout=15000)
+        return await page.evaluate(_LINKS_JS)
\ No newline at end of file
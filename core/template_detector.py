@@ -2,6 +2,7 @@
 Pattern-based template detection engine.
 """
 import re
+from functools import lru_cache
 from typing import List, Dict
 from collections import defaultdict
 from urllib.parse import urlparse
@@ -11,13 +12,30 @@ from models import URLTemplate
 
 logger = logging.getLogger(__name__)
 
+_YEAR_RE = re.compile(r'^\d{4}$')
+_UUID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.I)
+
+
+@lru_cache(maxsize=8192)
+def _classify_segment(seg: str) -> str:
+    """Map a path segment to its placeholder (segments repeat heavily across a crawl)."""
+    if seg.isdigit():
+        return '{id}'
+    if len(seg) == 36 and _UUID_RE.match(seg):
+        return '{uuid}'
+    if _YEAR_RE.match(seg):
+        return '{year}'
+    if '-' in seg or '_' in seg:
+        return '{slug}'
+    return seg
+
 
 class TemplateDetector:
     """Groups URLs by structural patterns."""
     
     def detect_templates(self, urls: List[str]) -> List[URLTemplate]:
         """Identify unique page templates."""
-        logger.info(f"Analyzing {len(urls)} URLs")
+        logger.info("Analyzing %s URLs", len(urls))
         
         pattern_groups = self._group_by_pattern(urls)
         templates = []
@@ -36,7 +54,7 @@ class TemplateDetector:
         # Sort: simpler first, then by popularity
         templates.sort(key=lambda t: (t.parameter_count, -t.total_matches))
         
-        logger.info(f"Identified {len(templates)} templates")
+        logger.info("Identified %s templates", len(templates))
         return templates
     
     def _group_by_pattern(self, urls: List[str]) -> Dict[str, List[str]]:
@@ -56,26 +74,7 @@ class TemplateDetector:
         if not path:
             return '/'
         
-        segments = []
-        for seg in path.split('/'):
-            if not seg:
-                continue
-            if seg.isdigit():
-                segments.append('{id}')
-            elif self._is_uuid(seg):
-                segments.append('{uuid}')
-            elif re.match(r'^\d{4}$', seg):
-                segments.append('{year}')
-            elif '-' in seg or '_' in seg:
-                segments.append('{slug}')
-            else:
-                segments.append(seg)
-        
-        return '/' + '/'.join(segments)
-    
-    def _is_uuid(self, s: str) -> bool:
-        """Check UUID pattern."""
-        return bool(re.match(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', s, re.I))
+        return '/' + '/'.join(_classify_segment(seg) for seg in path.split('/') if seg)
     
     def _infer_type(self, pattern: str) -> str:
         """Classify pattern."""
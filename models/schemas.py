@@ -2,7 +2,7 @@
 Enterprise data schemas for reverse engineering.
 """
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel, Field, HttpUrl
+from pydantic import BaseModel, ConfigDict, Field, HttpUrl
 from datetime import datetime
 from enum import Enum
 
@@ -65,8 +65,7 @@ class NavigationItem(BaseModel):
     target: str
     nav_type: str = Field(alias="type")
     
-    class Config:
-        populate_by_name = True
+    model_config = ConfigDict(populate_by_name=True)
 
 
 class TechnicalDetails(BaseModel):
@@ -141,7 +140,5 @@ class SiteArchitecture(BaseModel):
     # Performance
     analysis_duration_seconds: float
     
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
\ No newline at end of file
+    # Report file identifier (start-time stamp, shared by saved file and export)
+    report_id: Optional[str] = None
\ No newline at end of file